@@ -14,10 +14,22 @@ class Database:
 db_instance = Database()
 
 def connect():
-    db_instance.client = AsyncIOMotorClient(MONGODB_URL)
+    db_instance.client = AsyncIOMotorClient(
+        MONGODB_URL,
+        minPoolSize=10,
+        maxPoolSize=50,
+        serverSelectionTimeoutMS=2000,
+        connectTimeoutMS=2000,
+        retryWrites=True
+    )
     db_instance.db = db_instance.client[DB_NAME]
     print("Connected to MongoDB!")
 
+async def create_indexes():
+    # Uniqueness of email/username is enforced by the server on insert
+    await db_instance.db.users.create_index("email", unique=True)
+    await db_instance.db.users.create_index("username", unique=True)
+
 def close():
     db_instance.client.close()
     print("Disconnected from MongoDB!")
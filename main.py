@@ -1,20 +1,28 @@
 from fastapi import FastAPI
-from database import connect, close, db_instance
+from fastapi.responses import ORJSONResponse
+from database import connect, close, create_indexes, db_instance
 from routes.api import api_router
+from services.login_activity_service import LoginActivityService
 
 app = FastAPI(
     title="ICEFIT API",
     description="A comprehensive fitness and health tracking API",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 @app.on_event("startup")
 async def startup_db_client():
     connect()
+    # Open the first pooled connection before serving traffic
+    await db_instance.client.admin.command("ping")
+    await create_indexes()
     app.mongodb = db_instance.db
+    LoginActivityService.start(db_instance.db)
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await LoginActivityService.stop()
     close()
 
 # Include API routes
@@ -28,3 +36,10 @@ async def root():
         "api_health": "/api/health",
         "version": "1.0.0"
     }
+
+if __name__ == "__main__":
+    import os
+    import uvicorn
+
+    # "auto" selects uvloop when installed (it is not available on Windows)
+    uvicorn.run("main:app", loop="auto", http="httptools", workers=os.cpu_count())
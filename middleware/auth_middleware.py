@@ -1,13 +1,73 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from motor.motor_asyncio import AsyncIOMotorDatabase
-from services.auth_service import AuthService
+from services.auth_service import AuthService, CREDENTIALS_EXCEPTION
 from database import get_database
 from bson import ObjectId
-from typing import Dict, Any
+from cachetools import TLRUCache
+from typing import Dict, Any, Set
+import hashlib
+import time
 
 security = HTTPBearer()
 
+USER_NOT_FOUND_EXCEPTION = HTTPException(
+    status_code=status.HTTP_401_UNAUTHORIZED,
+    detail="User not found",
+    headers={"WWW-Authenticate": "Bearer"},
+)
+INACTIVE_USER_EXCEPTION = HTTPException(
+    status_code=status.HTTP_401_UNAUTHORIZED,
+    detail="Inactive user",
+    headers={"WWW-Authenticate": "Bearer"},
+)
+
+# Fields left out of the user document loaded for authenticated requests
+USER_PROJECTION = {"password_hash": 0}
+
+# Authenticated users keyed by a digest of their bearer token. Entries expire after
+# USER_CACHE_TTL_SECONDS or when the token itself expires, whichever comes first.
+USER_CACHE_TTL_SECONDS = 60
+_user_cache = TLRUCache(
+    maxsize=10_000,
+    ttu=lambda _key, entry, now: min(now + USER_CACHE_TTL_SECONDS, entry[1]),
+    timer=time.time,
+)
+
+# Cache keys per user id, so a user's entries can be dropped without scanning the
+# cache. Keys of entries that expired or were evicted linger until the next prune.
+_user_cache_keys: Dict[ObjectId, Set[bytes]] = {}
+_inserts_since_prune = 0
+
+def _token_cache_key(token: str) -> bytes:
+    return hashlib.blake2b(token.encode('utf-8'), digest_size=16).digest()
+
+def _cache_user(cache_key: bytes, user: Dict[str, Any], exp: float) -> None:
+    global _inserts_since_prune
+    _user_cache[cache_key] = (user, exp)
+    _user_cache_keys.setdefault(user['_id'], set()).add(cache_key)
+    
+    # Prune once per maxsize inserts, so the index stays within twice the cache size
+    _inserts_since_prune += 1
+    if _inserts_since_prune >= _user_cache.maxsize:
+        _inserts_since_prune = 0
+        for user_id, keys in list(_user_cache_keys.items()):
+            live_keys = {key for key in keys if key in _user_cache}
+            if live_keys:
+                _user_cache_keys[user_id] = live_keys
+            else:
+                del _user_cache_keys[user_id]
+
+def invalidate_cached_user(user_id: ObjectId) -> None:
+    """
+    Drop every cached entry for a user, e.g. after their profile changed
+    
+    Only this worker's cache is affected: other workers keep serving their copy
+    until it expires, for at most USER_CACHE_TTL_SECONDS.
+    """
+    for key in _user_cache_keys.pop(user_id, ()):
+        _user_cache.pop(key, None)
+
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
     db: AsyncIOMotorDatabase = Depends(get_database)
@@ -16,36 +76,33 @@ async def get_current_user(
     Dependency to get current authenticated user from JWT token
     """
     try:
+        cache_key = _token_cache_key(credentials.credentials)
+        cached = _user_cache.get(cache_key)
+        if cached is not None:
+            return cached[0]
+        
         # Verify token and get user ID
-        user_id = AuthService.get_user_id_from_token(credentials.credentials)
+        payload = AuthService.verify_token(credentials.credentials)
+        user_id = payload.get("sub")
+        if user_id is None:
+            raise CREDENTIALS_EXCEPTION.with_traceback(None)
         
-        # Find user in database
-        user = await db.users.find_one({"_id": ObjectId(user_id)})
+        # Find user in database; the password hash is never needed past login
+        user = await db.users.find_one({"_id": ObjectId(user_id)}, USER_PROJECTION)
         if user is None:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="User not found",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
+            raise USER_NOT_FOUND_EXCEPTION.with_traceback(None)
         
         # Check if user is active
         if not user.get("is_active", True):
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Inactive user",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
+            raise INACTIVE_USER_EXCEPTION.with_traceback(None)
         
+        _cache_user(cache_key, user, payload.get("exp", 0))
         return user
         
     except HTTPException:
         raise
     except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Could not validate credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+        raise CREDENTIALS_EXCEPTION.with_traceback(None)
 
 async def get_current_user_id(
     credentials: HTTPAuthorizationCredentials = Depends(security)
@@ -1,18 +1,26 @@
-from pydantic import BaseModel, Field, EmailStr, validator
-from typing import Optional, Literal
+from pydantic import BaseModel, ConfigDict, Field, EmailStr
+from pydantic_core import core_schema
+from typing import Optional, Literal, Union
 from datetime import datetime
 from bson import ObjectId
+from bson.errors import InvalidId
 
 class PyObjectId(ObjectId):
     @classmethod
-    def __get_validators__(cls):
-        yield cls.validate
+    def __get_pydantic_core_schema__(cls, source_type, handler):
+        return core_schema.no_info_plain_validator_function(
+            cls.validate,
+            serialization=core_schema.plain_serializer_function_ser_schema(str, when_used='json'),
+        )
 
     @classmethod
     def validate(cls, v):
-        if not ObjectId.is_valid(v):
+        if isinstance(v, ObjectId):
+            return v
+        try:
+            return ObjectId(v)
+        except (InvalidId, TypeError):
             raise ValueError("Invalid objectid")
-        return ObjectId(v)
 
     @classmethod
     def __get_pydantic_json_schema__(cls, core_schema, handler):
@@ -70,50 +78,13 @@ class UserRegisterModel(BaseModel):
     created_at: Optional[datetime] = None
     updated_at: Optional[datetime] = None
 
-    @validator('target_weight_kg', always=True)
-    def set_target_weight(cls, v, values):
-        if v is not None:
-            return v
-        if 'goal' in values and 'weight_kg' in values:
-            if values['goal'] == 'lose_weight':
-                return values['weight_kg'] - 10
-            elif values['goal'] == 'gain_weight':
-                return values['weight_kg'] + 10
-            elif values['goal'] == 'build_muscle':
-                return values['weight_kg'] + 5
-            else:
-                return values['weight_kg']
-        return None
-
-    @validator('age', always=True)
-    def calculate_age(cls, v, values):
-        if v is not None:
-            return v
-        if 'date_of_birth' in values:
-            today = datetime.now()
-            dob = values['date_of_birth']
-            age = today.year - dob.year - ((today.month, today.day) < (dob.month, dob.day))
-            return age
-        return None
-
-    @validator('created_at', always=True)
-    def set_created_at(cls, v):
-        return v or datetime.utcnow()
-
-    @validator('updated_at', always=True)
-    def set_updated_at(cls, v):
-        return datetime.utcnow()
-
-    class Config:
-        allow_population_by_field_name = True
-        arbitrary_types_allowed = True
-        json_encoders = {ObjectId: str}
+    model_config = ConfigDict(populate_by_name=True, arbitrary_types_allowed=True)
 
 class UserModel(BaseModel):
     id: Optional[PyObjectId] = Field(default_factory=PyObjectId, alias="_id")
     email: EmailStr
     username: str
-    password_hash: str
+    password_hash: Union[bytes, str]  # bcrypt hash; documents created before it was stored as bytes hold a str
     
     # Personal Details
     first_name: str
@@ -163,30 +134,46 @@ class UserModel(BaseModel):
     last_login: Optional[datetime] = None
     is_active: bool = True
     
-    class Config:
-        allow_population_by_field_name = True
-        arbitrary_types_allowed = True
-        json_encoders = {ObjectId: str}
+    model_config = ConfigDict(populate_by_name=True, arbitrary_types_allowed=True, frozen=True)
 
 class UserLoginModel(BaseModel):
     email: EmailStr
     password: str
 
 class UserUpdateModel(BaseModel):
-    first_name: Optional[str] = None
-    last_name: Optional[str] = None
-    weight_kg: Optional[float] = None
-    goal: Optional[str] = None
+    # Fields left out of the request are not changed. Fields that cannot be cleared
+    # (e.g. metric inputs) default to None without allowing an explicit null.
+    
+    # Personal Details
+    first_name: str = Field(None, min_length=1, max_length=50)
+    last_name: str = Field(None, min_length=1, max_length=50)
+    date_of_birth: datetime = Field(None)
+    gender: Literal['male', 'female', 'other'] = Field(None)
+    age: int = Field(None)
+    
+    # Physical Measurements
+    height_cm: float = Field(None, gt=50, lt=300)
+    weight_kg: float = Field(None, gt=20, lt=500)
+    
+    # Fitness Goals
+    goal: Literal['lose_weight', 'gain_weight', 'maintain_weight', 'build_muscle', 'improve_endurance'] = Field(None)
     target_weight_kg: Optional[float] = None
     target_date: Optional[datetime] = None
-    activity_level: Optional[str] = None
-    gym_type: Optional[str] = None
-    day_streak: Optional[int] = None
+    activity_level: Literal['sedentary', 'light', 'moderate', 'active', 'very_active'] = Field(None)
+    
+    # Gym Information
+    gym_type: Literal['without_gym', 'home_garage', 'small_gym', 'medium_gym', 'big_gym'] = Field(None)
+    
+    # Gamification
+    day_streak: int = Field(None, ge=0)
+    
+    # Health Information
     medical_conditions: Optional[list[str]] = None
     allergies: Optional[list[str]] = None
     medications: Optional[list[str]] = None
-    dietary_restrictions: Optional[list[str]] = None
+    
+    # Dietary Preferences
+    dietary_restrictions: Optional[list[Literal['vegetarian', 'vegan', 'gluten_free', 'dairy_free', 'keto', 'paleo', 'halal', 'kosher']]] = None
     daily_calorie_goal: Optional[int] = None
     
-    class Config:
-        arbitrary_types_allowed = True
+    model_config = ConfigDict(extra='forbid')
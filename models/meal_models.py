@@ -1,7 +1,6 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import Optional, List, Literal
 from datetime import datetime, date
-from bson import ObjectId
 from models import PyObjectId
 
 class MealItem(BaseModel):
@@ -15,16 +14,20 @@ class MealItem(BaseModel):
     preparation_time: Optional[int] = None  # minutes
     ingredients: List[str] = []
     instructions: Optional[str] = None
+    
+    model_config = ConfigDict(frozen=True)
 
 class DayMealPlan(BaseModel):
-    breakfast: List[MealItem]
-    lunch: List[MealItem]
-    dinner: List[MealItem]
+    breakfast: List[MealItem] = []
+    lunch: List[MealItem] = []
+    dinner: List[MealItem] = []
     snacks: List[MealItem] = []
-    total_calories: int
-    total_protein: float
-    total_carbs: float
-    total_fat: float
+    total_calories: int = 0
+    total_protein: float = 0.0
+    total_carbs: float = 0.0
+    total_fat: float = 0.0
+    
+    model_config = ConfigDict(frozen=True)
 
 class WeeklyMealPlan(BaseModel):
     id: Optional[PyObjectId] = Field(default_factory=PyObjectId, alias="_id")
@@ -40,10 +43,7 @@ class WeeklyMealPlan(BaseModel):
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
     
-    class Config:
-        allow_population_by_field_name = True
-        arbitrary_types_allowed = True
-        json_encoders = {ObjectId: str}
+    model_config = ConfigDict(populate_by_name=True, arbitrary_types_allowed=True, frozen=True)
 
 class MealPlanRequest(BaseModel):
     dietary_preferences: Optional[List[str]] = []
@@ -66,10 +66,7 @@ class DayProgress(BaseModel):
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
     
-    class Config:
-        allow_population_by_field_name = True
-        arbitrary_types_allowed = True
-        json_encoders = {ObjectId: str}
+    model_config = ConfigDict(populate_by_name=True, arbitrary_types_allowed=True)
 
 class MealCompletionRequest(BaseModel):
     meal_type: Literal['breakfast', 'lunch', 'dinner', 'snacks']
@@ -1,18 +1,29 @@
+import asyncio
 from fastapi import APIRouter, HTTPException, Depends
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 from fastapi.encoders import jsonable_encoder
 from motor.motor_asyncio import AsyncIOMotorDatabase
-from models import UserRegisterModel, UserLoginModel, UserModel
+from pymongo.errors import DuplicateKeyError
+from models import UserRegisterModel, UserLoginModel, UserModel, UserUpdateModel
 from services.user_service import UserService, UserCalculationService
 from services.auth_service import AuthService
-from middleware.auth_middleware import get_current_user, get_current_user_id
+from services.login_activity_service import LoginActivityService
+from middleware.auth_middleware import USER_PROJECTION, get_current_user, get_current_user_id, invalidate_cached_user
 from database import get_database
 from datetime import datetime
 from typing import Dict, Any
 
 router = APIRouter()
 
-@router.post("/register", response_model=Dict[str, Any])
+# Profile fields that the calculated health metrics depend on
+METRIC_INPUT_FIELDS = {'weight_kg', 'height_cm', 'age', 'gender', 'activity_level', 'goal'}
+
+DUPLICATE_USER_MESSAGES = {
+    "email": "User with this email already exists",
+    "username": "Username already taken"
+}
+
+@router.post("/register", response_model=None)
 async def register_user(
     user: UserRegisterModel,
     db: AsyncIOMotorDatabase = Depends(get_database)
@@ -27,23 +38,20 @@ async def register_user(
     - Returns user profile with health insights
     """
     try:
-        # Check if user already exists
-        existing_user = await db.users.find_one({"email": user.email})
-        if existing_user:
-            raise HTTPException(status_code=400, detail="User with this email already exists")
-        
-        existing_username = await db.users.find_one({"username": user.username})
-        if existing_username:
-            raise HTTPException(status_code=400, detail="Username already taken")
-        
-        # Prepare user data for database
-        user_doc = UserService.prepare_user_for_db(user)
+        # Fill derived fields and prepare user data for database
+        # (off the event loop, since it includes the bcrypt hash)
+        UserService.apply_registration_defaults(user)
+        user_doc = await asyncio.to_thread(UserService.prepare_user_for_db, user)
         
-        # Insert user into database
-        result = await db.users.insert_one(user_doc)
+        # Insert user into database (unique indexes reject existing email/username)
+        try:
+            result = await db.users.insert_one(user_doc)
+        except DuplicateKeyError as e:
+            duplicate_field = next(iter((e.details or {}).get('keyPattern', {})), None)
+            raise HTTPException(status_code=400, detail=DUPLICATE_USER_MESSAGES.get(duplicate_field, "User already exists"))
         
-        # Get the created user
-        created_user = await db.users.find_one({"_id": result.inserted_id})
+        # The inserted document is authoritative, no need to read it back
+        created_user = {**user_doc, "_id": result.inserted_id}
         
         # Prepare response
         response_data = UserService.get_user_response(created_user)
@@ -51,7 +59,7 @@ async def register_user(
         # Generate JWT tokens
         tokens = AuthService.create_tokens(str(result.inserted_id), user.email)
         
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=201,
             content={
                 "message": "User registered successfully",
@@ -70,7 +78,7 @@ async def register_user(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
-@router.post("/login")
+@router.post("/login", response_model=None)
 async def login_user(
     credentials: UserLoginModel,
     db: AsyncIOMotorDatabase = Depends(get_database)
@@ -84,15 +92,12 @@ async def login_user(
         if not user:
             raise HTTPException(status_code=401, detail="Invalid email or password")
         
-        # Verify password
-        if not UserService.verify_password(credentials.password, user['password_hash']):
+        # Verify password (bcrypt is CPU-bound, keep it off the event loop)
+        if not await asyncio.to_thread(UserService.verify_password, credentials.password, user['password_hash']):
             raise HTTPException(status_code=401, detail="Invalid email or password")
         
-        # Update last login
-        await db.users.update_one(
-            {"_id": user['_id']},
-            {"$set": {"last_login": datetime.utcnow()}}
-        )
+        # Queue last login update, written in batches in the background
+        LoginActivityService.record_login(user['_id'], datetime.utcnow())
         
         # Prepare response
         response_data = UserService.get_user_response(user)
@@ -100,7 +105,7 @@ async def login_user(
         # Generate JWT tokens
         tokens = AuthService.create_tokens(str(user['_id']), user['email'])
         
-        return JSONResponse(
+        return ORJSONResponse(
             content={
                 "message": "Login successful",
                 "user": response_data,
@@ -113,7 +118,7 @@ async def login_user(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
-@router.get("/profile")
+@router.get("/profile", response_model=None)
 async def get_user_profile(
     current_user: Dict[str, Any] = Depends(get_current_user)
 ):
@@ -124,7 +129,7 @@ async def get_user_profile(
         # Prepare response from current authenticated user
         response_data = UserService.get_user_response(current_user)
         
-        return JSONResponse(
+        return ORJSONResponse(
             content={
                 "user": response_data,
                 "health_insights": {
@@ -140,9 +145,9 @@ async def get_user_profile(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
-@router.put("/profile")
+@router.put("/profile", response_model=None)
 async def update_user_profile(
-    updates: dict,
+    updates: UserUpdateModel,
     current_user: Dict[str, Any] = Depends(get_current_user),
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
@@ -150,38 +155,41 @@ async def update_user_profile(
     Update authenticated user profile and recalculate health metrics if needed
     """
     try:
-        from bson import ObjectId
-        
-        user_id = str(current_user['_id'])
-        
-        # Check if we need to recalculate metrics
-        recalculate_metrics = any(key in updates for key in ['weight_kg', 'height_cm', 'age', 'gender', 'activity_level', 'goal'])
-        
-        if recalculate_metrics:
-            # Update user data with new values
-            user_data = dict(current_user)
-            for key, value in updates.items():
-                if key in user_data:
-                    user_data[key] = value
+        changes = updates.model_dump(exclude_unset=True)
+        # Keep age in step with a new date of birth, as registration does
+        if 'date_of_birth' in changes and 'age' not in changes:
+            changes['age'] = UserCalculationService.calculate_age(changes['date_of_birth'])
+        
+        updated_user = current_user
+        if changes:
+            # Diff against the stored profile, not current_user: that comes from a
+            # per-worker cache and can be stale. This read replaces reading the
+            # user back after the update
+            stored_user = await db.users.find_one({"_id": current_user['_id']}, USER_PROJECTION) or current_user
+            changed = {k: v for k, v in changes.items() if stored_user.get(k) != v}
+            updated_user = stored_user
             
-            # Recalculate metrics
-            metrics = UserCalculationService.calculate_all_metrics(user_data)
-            updates.update(metrics)
-        
-        # Add updated timestamp
-        updates['updated_at'] = datetime.utcnow()
-        
-        # Update user in database
-        await db.users.update_one(
-            {"_id": ObjectId(user_id)},
-            {"$set": updates}
-        )
-        
-        # Get updated user
-        updated_user = await db.users.find_one({"_id": ObjectId(user_id)})
+            if changed:
+                # Recalculate metrics only if one of their inputs actually changed
+                if changed.keys() & METRIC_INPUT_FIELDS:
+                    metrics = UserCalculationService.calculate_all_metrics({**stored_user, **changed})
+                    changed.update(metrics)
+                
+                # Add updated timestamp
+                changed['updated_at'] = datetime.utcnow()
+                
+                # Update user in database
+                await db.users.update_one(
+                    {"_id": current_user['_id']},
+                    {"$set": changed}
+                )
+                invalidate_cached_user(current_user['_id'])
+                
+                # Apply the same changes locally instead of reading the user back
+                updated_user = {**stored_user, **changed}
         response_data = UserService.get_user_response(updated_user)
         
-        return JSONResponse(
+        return ORJSONResponse(
             content={
                 "message": "Profile updated successfully",
                 "user": response_data
@@ -194,26 +202,29 @@ async def update_user_profile(
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 # Helper functions for health insights
+BMI_INTERPRETATIONS = {
+    "underweight": "Your BMI indicates you're underweight. Consider consulting with a healthcare provider about healthy weight gain strategies.",
+    "normal": "Great! Your BMI is in the healthy range. Maintain your current lifestyle with regular exercise and balanced nutrition.",
+    "overweight": "Your BMI indicates you're overweight. Consider a balanced approach with regular exercise and portion control.",
+    "obese": "Your BMI indicates obesity. We recommend consulting with a healthcare provider for a comprehensive weight management plan."
+}
+
+CALORIE_GUIDANCE_TEMPLATES = {
+    "lose_weight": "To lose weight safely, aim for {calories} calories per day. This creates a moderate deficit for sustainable weight loss.",
+    "gain_weight": "To gain weight healthily, aim for {calories} calories per day. Focus on nutrient-dense foods and strength training.",
+    "build_muscle": "To build muscle, aim for {calories} calories per day with adequate protein (1.6-2.2g per kg body weight).",
+    "maintain_weight": "To maintain your current weight, aim for {calories} calories per day.",
+    "improve_endurance": "For endurance training, aim for {calories} calories per day, focusing on carbohydrates for energy."
+}
+DEFAULT_CALORIE_GUIDANCE_TEMPLATE = "Aim for {calories} calories per day based on your goals."
+
 def get_bmi_interpretation(bmi_status: str) -> str:
     """Get BMI interpretation message"""
-    interpretations = {
-        "underweight": "Your BMI indicates you're underweight. Consider consulting with a healthcare provider about healthy weight gain strategies.",
-        "normal": "Great! Your BMI is in the healthy range. Maintain your current lifestyle with regular exercise and balanced nutrition.",
-        "overweight": "Your BMI indicates you're overweight. Consider a balanced approach with regular exercise and portion control.",
-        "obese": "Your BMI indicates obesity. We recommend consulting with a healthcare provider for a comprehensive weight management plan."
-    }
-    return interpretations.get(bmi_status, "BMI status unknown")
+    return BMI_INTERPRETATIONS.get(bmi_status, "BMI status unknown")
 
 def get_calorie_guidance(goal: str, recommended_calories: int) -> str:
     """Get calorie guidance message"""
-    guidance = {
-        "lose_weight": f"To lose weight safely, aim for {recommended_calories} calories per day. This creates a moderate deficit for sustainable weight loss.",
-        "gain_weight": f"To gain weight healthily, aim for {recommended_calories} calories per day. Focus on nutrient-dense foods and strength training.",
-        "build_muscle": f"To build muscle, aim for {recommended_calories} calories per day with adequate protein (1.6-2.2g per kg body weight).",
-        "maintain_weight": f"To maintain your current weight, aim for {recommended_calories} calories per day.",
-        "improve_endurance": f"For endurance training, aim for {recommended_calories} calories per day, focusing on carbohydrates for energy."
-    }
-    return guidance.get(goal, f"Aim for {recommended_calories} calories per day based on your goals.")
+    return CALORIE_GUIDANCE_TEMPLATES.get(goal, DEFAULT_CALORIE_GUIDANCE_TEMPLATE).format(calories=recommended_calories)
 
 def get_weight_guidance(goal: str, recommended_change: float) -> str:
     """Get weight change guidance message"""
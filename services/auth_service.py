@@ -1,21 +1,36 @@
-from datetime import datetime, timedelta
+from datetime import timedelta
 from typing import Optional, Dict, Any
-from jose import JWTError, jwt
-from passlib.context import CryptContext
+import jwt
 from fastapi import HTTPException, status
+from cachetools import TLRUCache
+import hashlib
 import os
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Raised for every invalid/expired token. Shared instance: raise it via
+# CREDENTIALS_EXCEPTION.with_traceback(None) so tracebacks don't pile up on it.
+CREDENTIALS_EXCEPTION = HTTPException(
+    status_code=status.HTTP_401_UNAUTHORIZED,
+    detail="Could not validate credentials",
+    headers={"WWW-Authenticate": "Bearer"},
+)
+
+# Decoded token payloads keyed by a digest of the token, each kept until the token's exp
+_token_payload_cache = TLRUCache(
+    maxsize=50_000,
+    ttu=lambda _key, payload, _now: payload.get("exp", 0),
+    timer=time.time,
+)
+
 class AuthService:
     SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-here-change-in-production")
     ALGORITHM = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES = 30
     REFRESH_TOKEN_EXPIRE_DAYS = 7
     
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-    
     @classmethod
     def create_access_token(cls, data: Dict[str, Any], expires_delta: Optional[timedelta] = None) -> str:
         """
@@ -23,9 +38,9 @@ class AuthService:
         """
         to_encode = data.copy()
         if expires_delta:
-            expire = datetime.utcnow() + expires_delta
+            expire = int(time.time() + expires_delta.total_seconds())
         else:
-            expire = datetime.utcnow() + timedelta(minutes=cls.ACCESS_TOKEN_EXPIRE_MINUTES)
+            expire = int(time.time()) + cls.ACCESS_TOKEN_EXPIRE_MINUTES * 60
         
         to_encode.update({"exp": expire, "type": "access"})
         encoded_jwt = jwt.encode(to_encode, cls.SECRET_KEY, algorithm=cls.ALGORITHM)
@@ -37,7 +52,7 @@ class AuthService:
         Create JWT refresh token
         """
         to_encode = data.copy()
-        expire = datetime.utcnow() + timedelta(days=cls.REFRESH_TOKEN_EXPIRE_DAYS)
+        expire = int(time.time()) + cls.REFRESH_TOKEN_EXPIRE_DAYS * 24 * 60 * 60
         to_encode.update({"exp": expire, "type": "refresh"})
         encoded_jwt = jwt.encode(to_encode, cls.SECRET_KEY, algorithm=cls.ALGORITHM)
         return encoded_jwt
@@ -45,17 +60,19 @@ class AuthService:
     @classmethod
     def verify_token(cls, token: str) -> Dict[str, Any]:
         """
-        Verify and decode JWT token
+        Verify and decode JWT token, reusing the payload of tokens verified before
         """
+        cache_key = hashlib.blake2b(token.encode('utf-8'), digest_size=16).digest()
+        payload = _token_payload_cache.get(cache_key)
+        if payload is not None:
+            return payload
+        
         try:
             payload = jwt.decode(token, cls.SECRET_KEY, algorithms=[cls.ALGORITHM])
+            _token_payload_cache[cache_key] = payload
             return payload
-        except JWTError:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Could not validate credentials",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
+        except jwt.PyJWTError:
+            raise CREDENTIALS_EXCEPTION.with_traceback(None)
     
     @classmethod
     def get_user_id_from_token(cls, token: str) -> str:
@@ -65,11 +82,7 @@ class AuthService:
         payload = cls.verify_token(token)
         user_id: str = payload.get("sub")
         if user_id is None:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Could not validate credentials",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
+            raise CREDENTIALS_EXCEPTION.with_traceback(None)
         return user_id
     
     @classmethod
@@ -1,50 +1,25 @@
 import google.generativeai as genai
-import json
+import asyncio
+import hashlib
+import httpx
+import orjson
 import os
-from typing import Dict, Any, List
+from functools import lru_cache
+from typing import Dict, Any, List, Optional, Tuple, AsyncIterator
+from cachetools import TTLCache
 from dotenv import load_dotenv
-from models.meal_models import WeeklyMealPlan, DayMealPlan, MealItem
+from models.meal_models import WeeklyMealPlan, DayMealPlan
 from datetime import datetime, date, timedelta
 
 load_dotenv()
 
-class GeminiMealPlanService:
-    def __init__(self):
-        self.api_key = os.getenv("GEMINI_API_KEY")
-        if not self.api_key:
-            raise ValueError("GEMINI_API_KEY not found in environment variables")
-        
-        genai.configure(api_key=self.api_key)
-        self.model = genai.GenerativeModel('gemini-pro')
-    
-    def create_meal_plan_prompt(self, user_data: Dict[str, Any], preferences: Dict[str, Any]) -> str:
-        """
-        Create a comprehensive prompt for Gemini AI to generate meal plans
-        """
-        prompt = f"""
-You are a professional nutritionist and meal planning expert. Create a detailed 7-day meal plan for a user with the following profile:
-
-**USER PROFILE:**
-- Age: {user_data.get('age', 'N/A')}
-- Gender: {user_data.get('gender', 'N/A')}
-- Weight: {user_data.get('weight_kg', 'N/A')} kg
-- Height: {user_data.get('height_cm', 'N/A')} cm
-- BMI: {user_data.get('bmi', 'N/A')}
-- Activity Level: {user_data.get('activity_level', 'N/A')}
-- Fitness Goal: {user_data.get('goal', 'N/A')}
-- Target Weight: {user_data.get('target_weight_kg', 'N/A')} kg
-- Daily Calorie Goal: {user_data.get('recommended_daily_calories', 'N/A')} calories
-- BMR: {user_data.get('bmr', 'N/A')} calories
-- TDEE: {user_data.get('tdee', 'N/A')} calories
-- Gym Type: {user_data.get('gym_type', 'N/A')}
-
-**DIETARY PREFERENCES & RESTRICTIONS:**
-- Dietary Restrictions: {user_data.get('dietary_restrictions', [])}
-- Medical Conditions: {user_data.get('medical_conditions', [])}
-- Allergies: {user_data.get('allergies', [])}
-- Cuisine Preferences: {preferences.get('cuisine_preferences', [])}
-- Cooking Time Preference: {preferences.get('cooking_time_preference', 'moderate')}
-- Budget Level: {preferences.get('budget_level', 'moderate')}
+# Invariant part of the meal-plan prompt. It always comes first and is identical
+# on every request, with only the user section appended after it varying. At
+# ~460 tokens it is below Gemini's implicit-caching minimum (1024 tokens on 2.5
+# Flash), so this ordering saves nothing today; it only keeps the prompt ready
+# for prefix caching if the instructions grow past that threshold.
+MEAL_PLAN_INSTRUCTIONS = """
+You are a professional nutritionist and meal planning expert. Create a detailed 7-day meal plan for the user whose profile is given at the end of this prompt.
 
 **REQUIREMENTS:**
 1. Create a complete 7-day meal plan (Monday to Sunday)
@@ -70,10 +45,10 @@ You are a professional nutritionist and meal planning expert. Create a detailed
 **OUTPUT FORMAT:**
 Please provide the response in valid JSON format with the following structure:
 
-{{
-  "monday": {{
+{
+  "monday": {
     "breakfast": [
-      {{
+      {
         "name": "Meal Name",
         "calories": 400,
         "protein": 25.0,
@@ -84,7 +59,7 @@ Please provide the response in valid JSON format with the following structure:
         "preparation_time": 15,
         "ingredients": ["ingredient1", "ingredient2"],
         "instructions": "Step by step instructions"
-      }}
+      }
     ],
     "lunch": [...],
     "dinner": [...],
@@ -93,17 +68,150 @@ Please provide the response in valid JSON format with the following structure:
     "total_protein": 120.0,
     "total_carbs": 250.0,
     "total_fat": 65.0
-  }},
-  "tuesday": {{ ... }},
-  "wednesday": {{ ... }},
-  "thursday": {{ ... }},
-  "friday": {{ ... }},
-  "saturday": {{ ... }},
-  "sunday": {{ ... }}
-}}
+  },
+  "tuesday": { ... },
+  "wednesday": { ... },
+  "thursday": { ... },
+  "friday": { ... },
+  "saturday": { ... },
+  "sunday": { ... }
+}
 
 Ensure the JSON is valid and complete. Focus on creating nutritious, balanced, and enjoyable meals that support the user's fitness goals.
 """
+
+# Per-user part of the meal-plan prompt, appended after MEAL_PLAN_INSTRUCTIONS
+USER_SECTION_TEMPLATE = """
+**USER PROFILE:**
+- Age: {age}
+- Gender: {gender}
+- Weight: {weight_kg} kg
+- Height: {height_cm} cm
+- BMI: {bmi}
+- Activity Level: {activity_level}
+- Fitness Goal: {goal}
+- Target Weight: {target_weight_kg} kg
+- Daily Calorie Goal: {recommended_daily_calories} calories
+- BMR: {bmr} calories
+- TDEE: {tdee} calories
+- Gym Type: {gym_type}
+
+**DIETARY PREFERENCES & RESTRICTIONS:**
+- Dietary Restrictions: {dietary_restrictions}
+- Medical Conditions: {medical_conditions}
+- Allergies: {allergies}
+- Cuisine Preferences: {cuisine_preferences}
+- Cooking Time Preference: {cooking_time_preference}
+- Budget Level: {budget_level}
+"""
+USER_SECTION_DEFAULTS = {'dietary_restrictions': [], 'medical_conditions': [], 'allergies': []}
+PREFERENCE_DEFAULTS = {'cuisine_preferences': [], 'cooking_time_preference': 'moderate', 'budget_level': 'moderate'}
+
+class _PromptFields(dict):
+    """Template fields; anything missing from the user profile renders as N/A"""
+    
+    def __missing__(self, key: str) -> str:
+        return 'N/A'
+
+DAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
+class _TopLevelMemberScanner:
+    """
+    Incrementally scans streamed text holding one JSON object and returns each
+    `"key": {...}` / `"key": [...]` member as soon as its value is complete.
+    Text before the opening brace (e.g. a ```json fence) and after the closing
+    brace is ignored.
+    """
+    
+    def __init__(self):
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._finished = False
+        self._key_chars: List[str] = []
+        self._key = None
+        self._value_chars: List[str] = []
+    
+    def feed(self, text: str) -> List[Tuple[str, str]]:
+        completed = []
+        for char in text:
+            if self._finished:
+                break
+            if self._depth == 0 and char != '{':
+                continue
+            if self._depth >= 2:
+                self._value_chars.append(char)
+            
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._key = ''.join(self._key_chars)
+                elif self._depth == 1:
+                    self._key_chars.append(char)
+            elif char == '"':
+                self._in_string = True
+                if self._depth == 1:
+                    self._key_chars = []
+            elif char in '{[':
+                self._depth += 1
+                if self._depth == 2:
+                    self._value_chars = [char]
+            elif char in '}]':
+                self._depth -= 1
+                if self._depth == 1:
+                    completed.append((self._key, ''.join(self._value_chars)))
+                elif self._depth == 0:
+                    self._finished = True
+        return completed
+
+# Stands in for any day missing from a response; shared safely because DayMealPlan is frozen
+EMPTY_DAY_MEAL_PLAN = DayMealPlan()
+
+# Generated meal plans keyed by profile fingerprint, shared by all service instances
+MEAL_PLAN_CACHE_TTL_SECONDS = 7 * 24 * 60 * 60
+_meal_plan_cache = TTLCache(maxsize=1024, ttl=MEAL_PLAN_CACHE_TTL_SECONDS)
+
+# Ask for a bare JSON response (no markdown fences or surrounding prose)
+GENERATION_CONFIG = {'response_mime_type': 'application/json'}
+
+@lru_cache(maxsize=1)
+def _get_model(api_key: str, model_name: str) -> genai.GenerativeModel:
+    """Configure the SDK and build the model once, shared by all service instances"""
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(model_name, generation_config=GENERATION_CONFIG)
+
+class GeminiMealPlanService:
+    MODEL_NAME = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+    MAX_CONCURRENT_REQUESTS = 10  # keeps generate_many within the per-minute request quota
+    
+    # Batch Mode (asynchronous, discounted, not subject to per-minute rate limits)
+    BATCH_API_URL = "https://generativelanguage.googleapis.com/v1beta"
+    BATCH_MAX_REQUESTS = 5000  # keeps each inline batch well under the 20 MB request limit
+    BATCH_POLL_INTERVAL_SECONDS = 60
+    
+    def __init__(self):
+        self.api_key = os.getenv("GEMINI_API_KEY")
+        if not self.api_key:
+            raise ValueError("GEMINI_API_KEY not found in environment variables")
+        
+        self.model = _get_model(self.api_key, self.MODEL_NAME)
+    
+    def create_meal_plan_prompt(self, user_data: Dict[str, Any], preferences: Dict[str, Any]) -> str:
+        """
+        Create a comprehensive prompt for Gemini AI to generate meal plans
+        """
+        fields = _PromptFields(USER_SECTION_DEFAULTS)
+        fields.update(user_data)
+        for key, default in PREFERENCE_DEFAULTS.items():
+            fields[key] = preferences.get(key, default)
+        
+        user_section = USER_SECTION_TEMPLATE.format_map(fields)
+        prompt = MEAL_PLAN_INSTRUCTIONS + user_section
         return prompt
     
     async def generate_meal_plan(self, user_data: Dict[str, Any], preferences: Dict[str, Any]) -> Dict[str, Any]:
@@ -111,33 +219,222 @@ Ensure the JSON is valid and complete. Focus on creating nutritious, balanced, a
         Generate a weekly meal plan using Gemini AI
         """
         try:
+            # Users with an equivalent profile get the plan generated for the first one
+            fingerprint = self.create_profile_fingerprint(user_data, preferences)
+            cached_plan = _meal_plan_cache.get(fingerprint)
+            if cached_plan is not None:
+                return cached_plan
+            
             prompt = self.create_meal_plan_prompt(user_data, preferences)
             
-            response = self.model.generate_content(prompt)
+            response = await self.model.generate_content_async(prompt)
             
             # Extract JSON from response
-            response_text = response.text
-            
-            # Clean the response to extract JSON
-            if "```json" in response_text:
-                json_start = response_text.find("```json") + 7
-                json_end = response_text.find("```", json_start)
-                json_text = response_text[json_start:json_end].strip()
-            elif "{" in response_text:
-                json_start = response_text.find("{")
-                json_end = response_text.rfind("}") + 1
-                json_text = response_text[json_start:json_end]
-            else:
-                raise ValueError("No valid JSON found in response")
-            
-            # Parse JSON
-            meal_plan_data = json.loads(json_text)
+            meal_plan_data = self.parse_meal_plan_response(response.text)
             
+            _meal_plan_cache[fingerprint] = meal_plan_data
             return meal_plan_data
             
         except Exception as e:
             raise Exception(f"Failed to generate meal plan: {str(e)}")
     
+    async def stream_meal_plan_days(
+        self,
+        user_data: Dict[str, Any],
+        preferences: Dict[str, Any]
+    ) -> AsyncIterator[Tuple[str, DayMealPlan]]:
+        """
+        Generate a weekly meal plan, yielding (day_name, DayMealPlan) for each day
+        as soon as Gemini has streamed it instead of after the whole week
+        """
+        try:
+            fingerprint = self.create_profile_fingerprint(user_data, preferences)
+            cached_plan = _meal_plan_cache.get(fingerprint)
+            if cached_plan is not None:
+                for day_name in DAYS:
+                    yield day_name, self.create_day_meal_plan(cached_plan.get(day_name))
+                return
+            
+            prompt = self.create_meal_plan_prompt(user_data, preferences)
+            
+            response = await self.model.generate_content_async(prompt, stream=True)
+            
+            scanner = _TopLevelMemberScanner()
+            meal_plan_data = {}
+            async for chunk in response:
+                for day_name, day_json in scanner.feed(chunk.text):
+                    if day_name in DAYS:
+                        meal_plan_data[day_name] = orjson.loads(day_json)
+                        yield day_name, self.create_day_meal_plan(meal_plan_data[day_name])
+            
+            if len(meal_plan_data) == len(DAYS):
+                _meal_plan_cache[fingerprint] = meal_plan_data
+            
+        except Exception as e:
+            raise Exception(f"Failed to stream meal plan: {str(e)}")
+    
+    async def generate_many(self, users: List[Tuple[Dict[str, Any], Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """
+        Generate meal plans for several (user_data, preferences) pairs concurrently
+        """
+        semaphore = asyncio.Semaphore(self.MAX_CONCURRENT_REQUESTS)
+        
+        async def generate(user_data: Dict[str, Any], preferences: Dict[str, Any]) -> Dict[str, Any]:
+            async with semaphore:
+                return await self.generate_meal_plan(user_data, preferences)
+        
+        return await asyncio.gather(*(generate(user_data, preferences) for user_data, preferences in users))
+    
+    @staticmethod
+    def create_profile_fingerprint(user_data: Dict[str, Any], preferences: Dict[str, Any]) -> bytes:
+        """
+        Hash the profile fields that shape a meal plan into a cache key
+        
+        Age is bucketed into 5-year brackets and the calorie target rounded to
+        100 kcal so that near-identical profiles share a plan; restrictions,
+        medical conditions and allergies are matched exactly.
+        """
+        age = user_data.get('age')
+        calories = user_data.get('recommended_daily_calories')
+        profile = {
+            'age_bracket': age // 5 * 5 if age is not None else None,
+            'gender': user_data.get('gender'),
+            'goal': user_data.get('goal'),
+            'activity_level': user_data.get('activity_level'),
+            'gym_type': user_data.get('gym_type'),
+            'calories': round(calories, -2) if calories is not None else None,
+            'dietary_restrictions': sorted(user_data.get('dietary_restrictions') or []),
+            'medical_conditions': sorted(user_data.get('medical_conditions') or []),
+            'allergies': sorted(user_data.get('allergies') or []),
+            'cuisine_preferences': sorted(preferences.get('cuisine_preferences') or []),
+            'cooking_time_preference': preferences.get('cooking_time_preference', 'moderate'),
+            'budget_level': preferences.get('budget_level', 'moderate')
+        }
+        return hashlib.blake2b(orjson.dumps(profile, option=orjson.OPT_SORT_KEYS), digest_size=16).digest()
+    
+    @staticmethod
+    def parse_meal_plan_response(response_text: str) -> Dict[str, Any]:
+        """
+        Extract and parse the meal plan JSON from a Gemini response text
+        """
+        # Clean the response to extract JSON (each find doubles as the presence check)
+        fence_start = response_text.find("```json")
+        if fence_start != -1:
+            json_start = fence_start + 7
+            json_end = response_text.find("```", json_start)
+            json_text = response_text[json_start:json_end].strip()
+        else:
+            json_start = response_text.find("{")
+            if json_start == -1:
+                raise ValueError("No valid JSON found in response")
+            json_end = response_text.rfind("}") + 1
+            json_text = response_text[json_start:json_end]
+        
+        # Parse JSON
+        return orjson.loads(json_text)
+    
+    async def generate_meal_plans_batch(
+        self,
+        users: List[Tuple[str, Dict[str, Any], Dict[str, Any]]]
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        Generate meal plans for many users with Gemini Batch Mode
+        
+        Meant for non-interactive jobs such as the nightly regeneration of weekly
+        plans: results arrive minutes to hours later at half the price of
+        generate_meal_plan. Takes (user_id, user_data, preferences) tuples and
+        returns meal plan data keyed by user_id; users whose request failed are
+        left out of the result.
+        """
+        meal_plans = {}
+        async with httpx.AsyncClient(
+            base_url=self.BATCH_API_URL,
+            headers={"x-goog-api-key": self.api_key},
+            timeout=60
+        ) as client:
+            # Submit every job up front so they run side by side, then wait for all of them
+            chunks = [
+                users[start:start + self.BATCH_MAX_REQUESTS]
+                for start in range(0, len(users), self.BATCH_MAX_REQUESTS)
+            ]
+            operations = [await self._submit_batch(client, chunk) for chunk in chunks]
+            results = await asyncio.gather(*(
+                self._collect_batch(client, operation, chunk)
+                for operation, chunk in zip(operations, chunks)
+            ))
+        
+        for result in results:
+            meal_plans.update(result)
+        return meal_plans
+    
+    async def _submit_batch(
+        self,
+        client: httpx.AsyncClient,
+        users: List[Tuple[str, Dict[str, Any], Dict[str, Any]]]
+    ) -> Dict[str, Any]:
+        requests = [
+            {
+                "request": {
+                    "contents": [{"parts": [{"text": self.create_meal_plan_prompt(user_data, preferences)}]}],
+                    "generation_config": GENERATION_CONFIG
+                },
+                "metadata": {"key": user_id}
+            }
+            for user_id, user_data, preferences in users
+        ]
+        response = await client.post(
+            f"/models/{self.MODEL_NAME}:batchGenerateContent",
+            json={"batch": {"display_name": "weekly-meal-plans", "input_config": {"requests": {"requests": requests}}}}
+        )
+        response.raise_for_status()
+        return response.json()
+    
+    async def _collect_batch(
+        self,
+        client: httpx.AsyncClient,
+        operation: Dict[str, Any],
+        users: List[Tuple[str, Dict[str, Any], Dict[str, Any]]]
+    ) -> Dict[str, Dict[str, Any]]:
+        # Poll the batch operation until it finishes
+        while not operation.get("done"):
+            await asyncio.sleep(self.BATCH_POLL_INTERVAL_SECONDS)
+            response = await client.get(f"/{operation['name']}")
+            response.raise_for_status()
+            operation = response.json()
+        
+        state = operation.get("metadata", {}).get("state", "")
+        if "error" in operation or not state.endswith("SUCCEEDED"):
+            raise Exception(f"Meal plan batch {operation['name']} did not succeed: {operation.get('error', state)}")
+        
+        inlined_responses = operation.get("response", {}).get("inlinedResponses", {})
+        if isinstance(inlined_responses, dict):
+            inlined_responses = inlined_responses.get("inlinedResponses", [])
+        
+        meal_plans = {}
+        for index, inlined in enumerate(inlined_responses):
+            user_id = inlined.get("metadata", {}).get("key", users[index][0])
+            try:
+                if "error" in inlined:
+                    raise ValueError(inlined["error"])
+                parts = inlined["response"]["candidates"][0]["content"]["parts"]
+                response_text = "".join(part.get("text", "") for part in parts)
+                meal_plans[user_id] = self.parse_meal_plan_response(response_text)
+            except Exception as e:
+                print(f"Failed to generate meal plan for user {user_id} in batch: {str(e)}")
+        
+        return meal_plans
+    
+    @staticmethod
+    def create_day_meal_plan(day_data: Optional[Dict[str, Any]]) -> DayMealPlan:
+        """
+        Convert one day of Gemini meal plan data to a DayMealPlan model
+        """
+        if not day_data:
+            return EMPTY_DAY_MEAL_PLAN
+        
+        # Validates the nested MealItem lists in one pass; missing meals and totals use the model defaults
+        return DayMealPlan.model_validate(day_data)
+    
     def create_weekly_meal_plan_model(self, user_id: str, meal_plan_data: Dict[str, Any]) -> WeeklyMealPlan:
         """
         Convert Gemini response to WeeklyMealPlan model
@@ -145,37 +442,18 @@ Ensure the JSON is valid and complete. Focus on creating nutritious, balanced, a
         try:
             # Get the start of current week (Monday)
             today = date.today()
-            days_since_monday = today.weekday()
-            week_start = today - timedelta(days=days_since_monday)
+            week_start = today - timedelta(days=today.weekday())
             
-            # Convert each day's data to DayMealPlan
-            days = {}
-            for day_name in ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']:
-                day_data = meal_plan_data.get(day_name, {})
-                
-                # Convert meals to MealItem objects
-                breakfast = [MealItem(**meal) for meal in day_data.get('breakfast', [])]
-                lunch = [MealItem(**meal) for meal in day_data.get('lunch', [])]
-                dinner = [MealItem(**meal) for meal in day_data.get('dinner', [])]
-                snacks = [MealItem(**meal) for meal in day_data.get('snacks', [])]
-                
-                days[day_name] = DayMealPlan(
-                    breakfast=breakfast,
-                    lunch=lunch,
-                    dinner=dinner,
-                    snacks=snacks,
-                    total_calories=day_data.get('total_calories', 0),
-                    total_protein=day_data.get('total_protein', 0.0),
-                    total_carbs=day_data.get('total_carbs', 0.0),
-                    total_fat=day_data.get('total_fat', 0.0)
-                )
+            # Validate the whole week in one call; only the day keys are taken from
+            # the response, and missing days use the shared empty day
+            days = {day_name: meal_plan_data.get(day_name) or EMPTY_DAY_MEAL_PLAN for day_name in DAYS}
             
             # Create WeeklyMealPlan
-            weekly_plan = WeeklyMealPlan(
-                user_id=user_id,
-                week_start_date=week_start,
+            weekly_plan = WeeklyMealPlan.model_validate({
+                'user_id': user_id,
+                'week_start_date': week_start,
                 **days
-            )
+            })
             
             return weekly_plan
             
@@ -0,0 +1,70 @@
+import asyncio
+from datetime import datetime
+from typing import Optional
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+class LoginActivityService:
+    """Service that coalesces last_login writes into periodic bulk updates"""
+
+    FLUSH_INTERVAL_SECONDS = 0.2
+    MAX_BATCH_SIZE = 500
+
+    _queue: "asyncio.Queue[tuple[ObjectId, datetime]]" = asyncio.Queue()
+    _task: Optional[asyncio.Task] = None
+    _stop_event: Optional[asyncio.Event] = None
+    _db: Optional[AsyncIOMotorDatabase] = None
+
+    @classmethod
+    def record_login(cls, user_id: ObjectId, timestamp: datetime) -> None:
+        """Queue a last_login update, to be written by the next flush"""
+        cls._queue.put_nowait((user_id, timestamp))
+
+    @classmethod
+    def start(cls, db: AsyncIOMotorDatabase) -> None:
+        """Start the background flush loop"""
+        cls._db = db
+        cls._stop_event = asyncio.Event()
+        cls._task = asyncio.create_task(cls._flush_periodically())
+
+    @classmethod
+    async def stop(cls) -> None:
+        """Stop the flush loop and write out anything still queued"""
+        if cls._task is not None:
+            # Signal the loop instead of cancelling it, so a batch already taken
+            # off the queue and being written is not lost
+            cls._stop_event.set()
+            await cls._task
+            cls._task = None
+        await cls.flush()
+
+    @classmethod
+    async def flush(cls) -> None:
+        """Write all queued logins, keeping only the latest timestamp per user"""
+        while not cls._queue.empty():
+            latest_logins = {}
+            while not cls._queue.empty() and len(latest_logins) < cls.MAX_BATCH_SIZE:
+                user_id, timestamp = cls._queue.get_nowait()
+                latest_logins[user_id] = timestamp
+
+            try:
+                await cls._db.users.bulk_write(
+                    [
+                        UpdateOne({"_id": user_id}, {"$set": {"last_login": timestamp}})
+                        for user_id, timestamp in latest_logins.items()
+                    ],
+                    ordered=False
+                )
+            except PyMongoError as e:
+                print(f"Failed to write last_login updates: {e}")
+
+    @classmethod
+    async def _flush_periodically(cls) -> None:
+        while not cls._stop_event.is_set():
+            try:
+                await asyncio.wait_for(cls._stop_event.wait(), timeout=cls.FLUSH_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            await cls.flush()
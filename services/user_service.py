@@ -1,89 +1,197 @@
+from bisect import bisect_right
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, ClassVar, Mapping, Sequence, Tuple, Union, overload
 import bcrypt
+import numpy as np
+import os
+from dotenv import load_dotenv
 from models import UserRegisterModel, UserModel
 
+load_dotenv()
+
+# The formula kernels accept scalars or NumPy arrays (batch path)
+Numeric = Union[float, np.ndarray]
+
+# Mifflin-St Jeor sex-specific constant
+MALE_BMR_OFFSET = 5
+FEMALE_BMR_OFFSET = -161
+
+# Activity multipliers indexed by ACTIVITY_LEVEL_INDEX; unknown levels use index 0 (sedentary)
+ACTIVITY_MULTIPLIERS = (1.2, 1.375, 1.55, 1.725, 1.9)
+ACTIVITY_LEVEL_INDEX = {
+    'sedentary': 0,
+    'light': 1,
+    'moderate': 2,
+    'active': 3,
+    'very_active': 4
+}
+
+# Formula kernels: numbers in, numbers out, no string handling or rounding,
+# so they work unchanged on scalars and element-wise on arrays.
+@overload
+def _bmi(weight_kg: float, height_cm: float) -> float: ...
+@overload
+def _bmi(weight_kg: np.ndarray, height_cm: np.ndarray) -> np.ndarray: ...
+def _bmi(weight_kg: Numeric, height_cm: Numeric) -> Numeric:
+    height_m = height_cm / 100
+    return weight_kg / (height_m ** 2)
+
+@overload
+def _bmr(weight_kg: float, height_cm: float, age: float, sex_offset: float) -> float: ...
+@overload
+def _bmr(weight_kg: np.ndarray, height_cm: np.ndarray, age: np.ndarray, sex_offset: np.ndarray) -> np.ndarray: ...
+def _bmr(weight_kg: Numeric, height_cm: Numeric, age: Numeric, sex_offset: Numeric) -> Numeric:
+    return 10 * weight_kg + 6.25 * height_cm - 5 * age + sex_offset
+
+# Upper bounds of each BMI category; bisect_right into them gives the BMI_STATUSES index
+BMI_THRESHOLDS = (18.5, 25, 30)
+BMI_STATUSES = ('underweight', 'normal', 'overweight', 'obese')
+BMI_STATUS_INDEX = {status: index for index, status in enumerate(BMI_STATUSES)}
+
+# Target BMI per BMI_STATUSES index: 20 (middle of the healthy range) when
+# underweight, 24 (upper end of it) when above it, 0 when no change is needed
+TARGET_BMIS = (20, 0, 24, 24)
+
+def _round2(values: np.ndarray) -> np.ndarray:
+    # np.round rounds values * 100, whose own rounding error can flip the result
+    # for values within a hair of a half-cent; re-round just those with the
+    # builtin round() used per user so both paths agree exactly
+    scaled = values * 100
+    whole = np.rint(scaled)
+    rounded = whole / 100  # what np.round(values, 2) computes
+    near_tie = np.abs(np.abs(scaled - whole) - 0.5) < 1e-6
+    if near_tie.any():
+        rounded[near_tie] = [round(value, 2) for value in values[near_tie].tolist()]
+    return rounded
+
+def _encode(values: np.ndarray, codes: Mapping[str, int], default: int) -> np.ndarray:
+    # One vectorised comparison per known value (the tables are tiny), instead of
+    # a dict lookup per user
+    encoded = np.full(values.shape, default, dtype=np.intp)
+    for value, code in codes.items():
+        encoded[values == value] = code
+    return encoded
+
+def _recommended_weight(height_cm: float, status: int) -> float:
+    target_bmi = TARGET_BMIS[status]
+    if not target_bmi:
+        return 0
+    return round(target_bmi * (height_cm / 100) ** 2, 2)
+
+# Goals encoded for the metric kernel; anything else is treated as maintain.
+# GOAL_LOSE_LARGE is derived from GOAL_LOSE when there is a lot of weight to lose.
+GOAL_LOSE = 0
+GOAL_LOSE_LARGE = 1
+GOAL_GAIN = 2
+GOAL_MAINTAIN = 3
+GOAL_CODES = {
+    'lose_weight': GOAL_LOSE,
+    'gain_weight': GOAL_GAIN,
+    'build_muscle': GOAL_GAIN
+}
+LARGE_WEIGHT_LOSS_KG = 10
+
+# Daily calorie adjustment indexed by goal code: a 500-750 kcal deficit for
+# 1-1.5 lbs per week (the larger one for larger weight loss), a 400 kcal
+# surplus for gaining weight or building muscle
+CALORIE_DELTAS = (-500, -750, 400, 0)
+
+def _calorie_goal(tdee: float, goal_code: int, weight_to_lose: float) -> int:
+    if goal_code == GOAL_LOSE and weight_to_lose > LARGE_WEIGHT_LOSS_KG:
+        goal_code = GOAL_LOSE_LARGE
+    return int(tdee + CALORIE_DELTAS[goal_code])
+
+def _metrics_kernel(
+    weight_kg: float,
+    height_cm: float,
+    age: int,
+    sex_offset: int,
+    activity_multiplier: float,
+    goal_code: int,
+    target_weight_kg: float
+) -> Tuple[float, int, Union[int, float], float, float, int]:
+    """All per-user metrics in one pass over plain numbers (strings are encoded by the caller)"""
+    bmi = round(_bmi(weight_kg, height_cm), 2)
+    status = bisect_right(BMI_THRESHOLDS, bmi)
+    
+    recommended_weight = _recommended_weight(height_cm, status)
+    recommended_weight_change: Union[int, float]  # 0 (int) when already in the healthy range
+    recommended_weight_change = round(recommended_weight - weight_kg, 2) if recommended_weight != 0 else 0
+    
+    bmr = round(_bmr(weight_kg, height_cm, age, sex_offset), 2)
+    tdee = round(bmr * activity_multiplier, 2)
+    
+    recommended_calories = _calorie_goal(tdee, goal_code, weight_kg - target_weight_kg)
+    
+    return bmi, status, recommended_weight_change, bmr, tdee, recommended_calories
+
 class UserCalculationService:
     """Service for calculating user health metrics"""
     
     @staticmethod
     def calculate_bmi(weight_kg: float, height_cm: float) -> float:
         """Calculate Body Mass Index"""
-        height_m = height_cm / 100
-        return round(weight_kg / (height_m ** 2), 2)
+        return round(_bmi(weight_kg, height_cm), 2)
     
     @staticmethod
     def get_bmi_status(bmi: float) -> str:
         """Get BMI status category"""
-        if bmi < 18.5:
-            return "underweight"
-        elif 18.5 <= bmi < 25:
-            return "normal"
-        elif 25 <= bmi < 30:
-            return "overweight"
-        else:
-            return "obese"
+        return BMI_STATUSES[bisect_right(BMI_THRESHOLDS, bmi)]
     
     @staticmethod
     def calculate_recommended_weight(height_cm: float, bmi_status: str) -> float:
         """Calculate recommended weight based on healthy BMI range"""
-        height_m = height_cm / 100
-        
-        if bmi_status in ["underweight"]:
-            # Target BMI of 20 (middle of healthy range)
-            return round(20 * (height_m ** 2), 2)
-        elif bmi_status == "normal":
-            # Already in healthy range, no change needed
-            return 0
-        else:  # overweight or obese
-            # Target BMI of 24 (upper healthy range)
-            return round(24 * (height_m ** 2), 2)
+        # Unknown statuses are treated as above the healthy range
+        return _recommended_weight(height_cm, BMI_STATUS_INDEX.get(bmi_status, len(BMI_STATUSES) - 1))
+    
+    @staticmethod
+    def calculate_age(date_of_birth: datetime) -> int:
+        """Calculate age in full years from date of birth"""
+        today = datetime.now()
+        return today.year - date_of_birth.year - ((today.month, today.day) < (date_of_birth.month, date_of_birth.day))
+    
+    @staticmethod
+    def get_default_target_weight(goal: str, weight_kg: float) -> float:
+        """Get default target weight for a fitness goal"""
+        if goal == 'lose_weight':
+            return weight_kg - 10
+        elif goal == 'gain_weight':
+            return weight_kg + 10
+        elif goal == 'build_muscle':
+            return weight_kg + 5
+        else:
+            return weight_kg
     
     @staticmethod
     def calculate_bmr(weight_kg: float, height_cm: float, age: int, gender: str) -> float:
         """Calculate Basal Metabolic Rate using Mifflin-St Jeor Equation"""
-        if gender.lower() == 'male':
-            bmr = 10 * weight_kg + 6.25 * height_cm - 5 * age + 5
-        else:  # female or other
-            bmr = 10 * weight_kg + 6.25 * height_cm - 5 * age - 161
-        
-        return round(bmr, 2)
+        # female or other use the female constant
+        sex_offset = MALE_BMR_OFFSET if gender.lower() == 'male' else FEMALE_BMR_OFFSET
+        return round(_bmr(weight_kg, height_cm, age, sex_offset), 2)
     
     @staticmethod
     def calculate_tdee(bmr: float, activity_level: str) -> float:
         """Calculate Total Daily Energy Expenditure"""
-        activity_multipliers = {
-            'sedentary': 1.2,
-            'light': 1.375,
-            'moderate': 1.55,
-            'active': 1.725,
-            'very_active': 1.9
-        }
-        
-        multiplier = activity_multipliers.get(activity_level, 1.2)
-        return round(bmr * multiplier, 2)
+        return round(bmr * ACTIVITY_MULTIPLIERS[ACTIVITY_LEVEL_INDEX.get(activity_level, 0)], 2)
     
     @staticmethod
     def calculate_calorie_goal(tdee: float, goal: str, target_weight_kg: float, current_weight_kg: float) -> int:
         """Calculate daily calorie goal based on fitness goal"""
-        if goal == 'lose_weight':
-            # Create a deficit of 500-750 calories per day for 1-1.5 lbs per week
-            weight_to_lose = current_weight_kg - target_weight_kg
-            if weight_to_lose > 10:  # More aggressive deficit for larger weight loss
-                return int(tdee - 750)
-            else:
-                return int(tdee - 500)
-        elif goal == 'gain_weight' or goal == 'build_muscle':
-            # Create a surplus of 300-500 calories per day
-            return int(tdee + 400)
-        else:  # maintain_weight or improve_endurance
-            return int(tdee)
+        return _calorie_goal(tdee, GOAL_CODES.get(goal, GOAL_MAINTAIN), current_weight_kg - target_weight_kg)
     
-    @classmethod
-    def calculate_all_metrics(cls, user_data) -> Dict[str, Any]:
+    @staticmethod
+    def calculate_all_metrics(user_data: Union[UserRegisterModel, Mapping[str, Any]]) -> Dict[str, Any]:
         """Calculate all health metrics for a user"""
-        # Handle both UserRegisterModel and dict inputs
-        if hasattr(user_data, 'weight_kg'):
+        # Handle both dict and UserRegisterModel inputs
+        if isinstance(user_data, Mapping):
+            weight_kg = user_data['weight_kg']
+            height_cm = user_data['height_cm']
+            age = user_data['age']
+            gender = user_data['gender']
+            activity_level = user_data['activity_level']
+            goal = user_data['goal']
+            target_weight_kg = user_data.get('target_weight_kg')
+        else:
             weight_kg = user_data.weight_kg
             height_cm = user_data.height_cm
             age = user_data.age
@@ -91,53 +199,119 @@ class UserCalculationService:
             activity_level = user_data.activity_level
             goal = user_data.goal
             target_weight_kg = user_data.target_weight_kg
+        
+        # Encode the string inputs once, then compute everything in a single kernel call
+        sex_offset = MALE_BMR_OFFSET if gender.lower() == 'male' else FEMALE_BMR_OFFSET
+        activity_multiplier = ACTIVITY_MULTIPLIERS[ACTIVITY_LEVEL_INDEX.get(activity_level, 0)]
+        goal_code = GOAL_CODES.get(goal, GOAL_MAINTAIN)
+        target_weight = target_weight_kg or weight_kg
+        
+        bmi, status, recommended_weight_change, bmr, tdee, recommended_calories = _metrics_kernel(
+            weight_kg, height_cm, age, sex_offset, activity_multiplier, goal_code, target_weight
+        )
+        
+        return {
+            'bmi': bmi,
+            'bmi_status': BMI_STATUSES[status],
+            'recommended_weight_change': recommended_weight_change,
+            'bmr': bmr,
+            'tdee': tdee,
+            'recommended_daily_calories': recommended_calories
+        }
+    
+    @staticmethod
+    def calculate_all_metrics_batch(users: Mapping[str, Sequence]) -> Dict[str, np.ndarray]:
+        """
+        Calculate all health metrics for many users at once (e.g. bulk imports)
+        
+        Takes columns weight_kg, height_cm, age, gender, activity_level, goal and
+        optionally target_weight_kg (a dict of sequences or a pandas DataFrame) and
+        returns the same keys as calculate_all_metrics, each as an array with one
+        entry per user, identical to what calculate_all_metrics gives each user.
+        """
+        weight_kg = np.asarray(users['weight_kg'], dtype=np.float64)
+        height_cm = np.asarray(users['height_cm'], dtype=np.float64)
+        age = np.asarray(users['age'], dtype=np.float64)
+        gender = np.asarray(users['gender'], dtype=str)
+        # Gender is case-insensitive like in calculate_bmr; lower-case only the
+        # entries that aren't already one of the usual values
+        unusual_gender = ~np.isin(gender, ('male', 'female', 'other'))
+        if unusual_gender.any():
+            gender = gender.copy()  # may be the caller's array
+            gender[unusual_gender] = np.char.lower(gender[unusual_gender])
+        activity_level = np.asarray(users['activity_level'], dtype=str)
+        goal = np.asarray(users['goal'], dtype=str)
+        target_weight_column = users.get('target_weight_kg')
+        if target_weight_column is None:
+            target_weight_kg = weight_kg
         else:
-            weight_kg = user_data['weight_kg']
-            height_cm = user_data['height_cm']
-            age = user_data['age']
-            gender = user_data['gender']
-            activity_level = user_data['activity_level']
-            goal = user_data['goal']
-            target_weight_kg = user_data.get('target_weight_kg')
+            # Missing targets (None/NaN) or 0 fall back to the current weight
+            target_weight_kg = np.asarray(target_weight_column, dtype=np.float64)
+            target_weight_kg = np.where(np.isnan(target_weight_kg) | (target_weight_kg == 0), weight_kg, target_weight_kg)
         
         # Calculate BMI
-        bmi = cls.calculate_bmi(weight_kg, height_cm)
-        bmi_status = cls.get_bmi_status(bmi)
+        bmi = _round2(_bmi(weight_kg, height_cm))
+        status = np.searchsorted(BMI_THRESHOLDS, bmi, side='right')
+        bmi_status = np.asarray(BMI_STATUSES)[status]
         
-        # Calculate recommended weight
-        recommended_weight = cls.calculate_recommended_weight(height_cm, bmi_status)
-        recommended_weight_change = recommended_weight - weight_kg if recommended_weight != 0 else 0
+        # Calculate recommended weight (0 where no change is needed)
+        recommended_weight = _round2(np.asarray(TARGET_BMIS)[status] * (height_cm / 100) ** 2)
+        recommended_weight_change = np.where(recommended_weight != 0, _round2(recommended_weight - weight_kg), 0.0)
         
         # Calculate BMR and TDEE
-        bmr = cls.calculate_bmr(weight_kg, height_cm, age, gender)
-        tdee = cls.calculate_tdee(bmr, activity_level)
+        sex_offset = _encode(gender, {'male': MALE_BMR_OFFSET}, FEMALE_BMR_OFFSET)
+        bmr = _round2(_bmr(weight_kg, height_cm, age, sex_offset))
+        multiplier = np.asarray(ACTIVITY_MULTIPLIERS)[_encode(activity_level, ACTIVITY_LEVEL_INDEX, 0)]
+        tdee = _round2(bmr * multiplier)
         
         # Calculate calorie goal
-        target_weight = target_weight_kg or weight_kg
-        recommended_calories = cls.calculate_calorie_goal(tdee, goal, target_weight, weight_kg)
+        goal_code = _encode(goal, GOAL_CODES, GOAL_MAINTAIN)
+        goal_code[(goal_code == GOAL_LOSE) & (weight_kg - target_weight_kg > LARGE_WEIGHT_LOSS_KG)] = GOAL_LOSE_LARGE
+        calorie_delta = np.asarray(CALORIE_DELTAS)[goal_code]
+        recommended_calories = np.trunc(tdee + calorie_delta).astype(np.int64)
         
         return {
             'bmi': bmi,
             'bmi_status': bmi_status,
-            'recommended_weight_change': round(recommended_weight_change, 2),
+            'recommended_weight_change': recommended_weight_change,
             'bmr': bmr,
             'tdee': tdee,
             'recommended_daily_calories': recommended_calories
         }
 
+# Optional list fields stored as empty lists rather than null
+LIST_FIELDS = ('medical_conditions', 'allergies', 'medications', 'dietary_restrictions')
+
 class UserService:
     """Service for user operations"""
     
-    @staticmethod
-    def hash_password(password: str) -> str:
-        """Hash password using bcrypt"""
-        salt = bcrypt.gensalt()
-        return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+    # bcrypt work factor; lower it in development/test environments to speed up auth
+    BCRYPT_ROUNDS: ClassVar[int] = int(os.getenv("BCRYPT_ROUNDS", "12"))
+    
+    @classmethod
+    def hash_password(cls, password: str) -> bytes:
+        """Hash password using bcrypt (stored as BSON binary, as bcrypt returns it)"""
+        salt = bcrypt.gensalt(rounds=cls.BCRYPT_ROUNDS)
+        return bcrypt.hashpw(password.encode('utf-8'), salt)
     
     @staticmethod
-    def verify_password(password: str, hashed_password: str) -> bool:
+    def verify_password(password: str, hashed_password: Union[bytes, str]) -> bool:
         """Verify password against hash"""
-        return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
+        # Users registered before hashes were stored as bytes have a str hash
+        if isinstance(hashed_password, str):
+            hashed_password = hashed_password.encode('utf-8')
+        return bcrypt.checkpw(password.encode('utf-8'), hashed_password)
+    
+    @staticmethod
+    def apply_registration_defaults(user_data: UserRegisterModel) -> None:
+        """Fill derived registration fields (age, target weight, timestamps) in place"""
+        if user_data.target_weight_kg is None:
+            user_data.target_weight_kg = UserCalculationService.get_default_target_weight(user_data.goal, user_data.weight_kg)
+        if user_data.age is None:
+            user_data.age = UserCalculationService.calculate_age(user_data.date_of_birth)
+        now = datetime.utcnow()
+        user_data.created_at = user_data.created_at or now
+        user_data.updated_at = now
     
     @staticmethod
     def prepare_user_for_db(user_data: UserRegisterModel) -> Dict[str, Any]:
@@ -148,37 +322,14 @@ class UserService:
         # Hash password
         password_hash = UserService.hash_password(user_data.password)
         
-        # Prepare user document
-        user_doc = {
-            'email': user_data.email,
-            'username': user_data.username,
-            'password_hash': password_hash,
-            'first_name': user_data.first_name,
-            'last_name': user_data.last_name,
-            'date_of_birth': user_data.date_of_birth,
-            'gender': user_data.gender,
-            'age': user_data.age,
-            'height_cm': user_data.height_cm,
-            'weight_kg': user_data.weight_kg,
-            'goal': user_data.goal,
-            'target_weight_kg': user_data.target_weight_kg,
-            'target_date': user_data.target_date,
-            'activity_level': user_data.activity_level,
-            'medical_conditions': user_data.medical_conditions or [],
-            'allergies': user_data.allergies or [],
-            'medications': user_data.medications or [],
-            'dietary_restrictions': user_data.dietary_restrictions or [],
-            'daily_calorie_goal': user_data.daily_calorie_goal,
-            'bmi': metrics['bmi'],
-            'bmi_status': metrics['bmi_status'],
-            'recommended_weight_change': metrics['recommended_weight_change'],
-            'recommended_daily_calories': metrics['recommended_daily_calories'],
-            'bmr': metrics['bmr'],
-            'tdee': metrics['tdee'],
-            'created_at': user_data.created_at,
-            'updated_at': user_data.updated_at,
-            'is_active': True
-        }
+        # Prepare user document: every model field except the plain password,
+        # with the calculated metrics overlaid
+        user_doc = user_data.model_dump(exclude={'password'})
+        user_doc.update(metrics)
+        user_doc['password_hash'] = password_hash
+        for field in LIST_FIELDS:
+            user_doc[field] = user_doc[field] or []
+        user_doc['is_active'] = True
         
         return user_doc
     